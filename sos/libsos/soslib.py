@@ -17,12 +17,39 @@
 
 import sys
 import os
+import io
 import json
+import time
+import calendar
+import hashlib
+import shelve
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as etree
 from osgeo import ogr, osr
 from grass.script import core as grass
 from grass.script import run_command
 
+# transformations already created by get_transformation()
+_transformations = dict()
+# timestamps already converted by seconds_to_timestamp()
+_timestamps = dict()
+# sensor descriptions already downloaded by describe_sensors()
+_descriptions = dict()
+# namespaces of the SensorML 1.0.1 documents read by parse_sensor()
+_sensorml_namespaces = {'sml': 'http://www.opengis.net/sensorML/1.0.1',
+                        'gml': 'http://www.opengis.net/gml'}
+# the observations cache is shared by the threads of get_observations()
+_cache_lock = threading.Lock()
+# key of the {key: time stored} index of the cached responses
+_cache_index_key = 'index'
+# characters unsupported in table names, replaced in a single pass
+_table_name_translation = str.maketrans(':-.', '___')
+
 
 def xml2geojson(xml_file, observed_property, import_empty=False):
     """Convert file in standard xml (text/xml;subtype="om/1.0.0") to geoJSON.
@@ -30,69 +57,114 @@ def xml2geojson(xml_file, observed_property, import_empty=False):
     :param xml_file: Response from SOS server in text/xml;subtype="om/1.0.0"
     :param observed_property: One observed property from SOS response
     :param import_empty: Import also empty procedures
-    :return json.dumps: Parsed response in geoJSON
+    :return a: Parsed response as a geoJSON dictionary
     """
-    tree = etree.ElementTree(etree.fromstring(xml_file))
-    a = {"type": "FeatureCollection", "features": []}
+    return xml2geojsons(xml_file, [observed_property],
+                        import_empty)[observed_property]
+
+
+def xml2geojsons(xml_file, observed_properties, import_empty=False):
+    """Convert file in standard xml (text/xml;subtype="om/1.0.0") to geoJSON.
+
+    The response is parsed only once for all the observed properties
 
-    root = tree.getroot()
+    :param xml_file: Response from SOS server in text/xml;subtype="om/1.0.0"
+    :param observed_properties: List of observed properties from SOS response
+    :param import_empty: Import also empty procedures
+    :return parsed: Dictionary in format {observed property: geoJSON dict}
+    """
+    parsed = dict()
+    for observed_property in observed_properties:
+        parsed.update({observed_property: {"type": "FeatureCollection",
+                                           "features": []}})
+
+    root = None
+    depth = 0
     crs = 0
 
-    for child in root.iter():
+    if not isinstance(xml_file, bytes):
+        xml_file = xml_file.encode('utf-8')
+
+    # the response is parsed incrementally and every member is dropped as
+    # soon as it is converted, so the whole tree is never held in memory
+    for event, child in etree.iterparse(io.BytesIO(xml_file),
+                                        events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = child
+            depth += 1
+            continue
+
+        depth -= 1
+
         if 'location' in child.tag:
             if crs and crs != list(child)[0].attrib['srsName']:
                 raise ValueError('CRS of different points within one offering '
                                  'do not match.')
             crs = list(child)[0].attrib['srsName']
 
-            a.update({"crs": {
-                "type": "name",
-                "properties": {"name": crs}}})
+            for a in parsed.values():
+                a.update({"crs": {
+                    "type": "name",
+                    "properties": {"name": crs}}})
 
-    for child in root.findall('{http://www.opengis.net/om/1.0}member'):
-        data = dict()
+        if depth != 1 or \
+                child.tag != '{http://www.opengis.net/om/1.0}member':
+            continue
+
+        name = None
         value_names = list()
-        name_found = False
         separator = ','
-        current_index = 1
-        include = True
-        wanted_index = None
+        quantities_count = 0
+        include = dict()
+        wanted_indices = dict()
+        data = dict()
+        for observed_property in observed_properties:
+            include.update({observed_property: True})
+            data.update({observed_property: dict()})
 
         for item in child.iter():
-            if 'name' in item.tag and name_found is False:
-                data.update({'name': item.text})
-                name_found = True
+            if 'name' in item.tag and name is None:
+                name = item.text
+                for observed_property in observed_properties:
+                    data[observed_property].update({'name': name})
             elif 'field' in item.tag:
                 value_names.append(item.attrib['name'])
             elif 'Quantity' in item.tag:
-                if observed_property in item.attrib['definition']:
-                    wanted_index = current_index
-                else:
-                    current_index += 1
+                quantities_count += 1
+                for observed_property in observed_properties:
+                    if observed_property in item.attrib['definition']:
+                        wanted_indices.setdefault(observed_property,
+                                                  quantities_count)
             elif 'TextBlock' in item.tag:
                 token_separator = item.attrib['tokenSeparator']
                 block_separator = item.attrib['blockSeparator']
             elif 'values' in item.tag:
-                if wanted_index is None:
+                if not wanted_indices:
                     continue
                 if not item.text:
-                    if import_empty:
-                        values = 0
-                    else:
-                        include = False
-                    run_command('g.message',
-                                flags='w',
-                                message='No observations of '
-                                        '{} found for procedure {}.'.format(
-                                    observed_property, data['name']))
+                    for observed_property in wanted_indices:
+                        if not import_empty:
+                            include.update({observed_property: False})
+                        run_command('g.message',
+                                    flags='w',
+                                    message='No observations of '
+                                            '{} found for procedure '
+                                            '{}.'.format(observed_property,
+                                                         name))
                     break
+                # every row is split and its timestamp normalized only once
+                # for all the observed properties
                 for values in item.text.split(block_separator):
-                    time_stamp = 't%s' % values.split(token_separator)[0]
+                    values = values.split(token_separator)
+                    time_stamp = 't{}'.format(values[0])
                     for character in [':', '-', '+']:
                         time_stamp = ''.join(time_stamp.split(character))
 
-                    data.update({time_stamp: values.split(
-                        token_separator)[wanted_index]})
+                    for observed_property, wanted_index in \
+                            wanted_indices.items():
+                        data[observed_property].update(
+                            {time_stamp: values[wanted_index]})
             elif 'location' in item.tag:
                 point = list(item)[0]
                 geometry_type = point.tag.split('}')[1]
@@ -100,27 +172,58 @@ def xml2geojson(xml_file, observed_property, import_empty=False):
                 for i in range(len(geometry_coords)):
                     geometry_coords[i] = float(geometry_coords[i])
 
-        if include:
-            a['features'].append(
-                {"type": "Feature",
-                 "geometry": {"type": geometry_type,
-                              "coordinates": geometry_coords},
-                 "properties": {
-                     key: value for key, value in data.items()}
-                 })
+        for observed_property in observed_properties:
+            if include[observed_property]:
+                parsed[observed_property]['features'].append(
+                    {"type": "Feature",
+                     "geometry": {"type": geometry_type,
+                                  "coordinates": list(geometry_coords)},
+                     "properties": data[observed_property]})
+
+        root.remove(child)
+
+    return parsed
+
+
+def parse_observation(response, observed_properties, response_format,
+                      version, import_empty=False):
+    """Convert a response from SOS server to geoJSON by its format.
+
+    :param response: Response from SOS server
+    :param observed_properties: List of observed properties from SOS response
+    :param response_format: Format of the response
+    :param version: Version of SOS server
+    :param import_empty: Import also empty procedures
+    :return parsed: Dictionary in format {observed property: geoJSON dict}
+    """
+    parsed = dict()
 
-    return json.dumps(a, indent=4, sort_keys=True)
+    if version in ['1.0.0', '1.0'] and \
+            response_format == 'text/xml;subtype="om/1.0.0"':
+        # one pass over the response for all the properties
+        parsed.update(xml2geojsons(response, observed_properties,
+                                   import_empty))
+    elif response_format == 'application/json':
+        # the conversion does not depend on the property, the response is
+        # parsed only once
+        geojson = json2geojson(response)
+        for observed_property in observed_properties:
+            parsed.update({observed_property: geojson})
 
+    return parsed
 
-def json2geojson(json_file):
+
+def json2geojson(json_file, observed_property=None):
     # TODO: Has to be updated, doesn't work really well (use xml2geojson)
     """Convert file in json format to geoJSON.
 
     :param json_file: Response from SOS server in json format
-    :return json.dumps: Parsed response in geoJSON
+    :param observed_property: Observed property we want to import (kept for
+        the same signature as xml2geojson, all the fields are imported)
+    :return a: Parsed response as a geoJSON dictionary
     """
-    json_file = json.loads(
-        json_file.decode('utf-8'))['ObservationCollection']['member']
+    # json.loads decodes the bytes itself, no intermediate unicode copy
+    json_file = json.loads(json_file)['ObservationCollection']['member']
 
     a = {"type": "FeatureCollection", "features": []}
 
@@ -140,12 +243,11 @@ def json2geojson(json_file):
         point = ogr.CreateGeometryFromGML(geom)
 
         data = {}
-        for i in range(int(feature['result']['DataArray']['elementCount'])):
-            values = []
-            for j in feature['result']['DataArray']['values']:
-                values.append(j[i])
-            data.update(
-                {feature['result']['DataArray']['field'][i]['name']: values})
+        # rows transposed to columns in one pass
+        columns = zip(*feature['result']['DataArray']['values'])
+        for field, values in zip(feature['result']['DataArray']['field'],
+                                 columns):
+            data.update({field['name']: list(values)})
 
         data.update({'name': feature['name']})
 
@@ -157,7 +259,7 @@ def json2geojson(json_file):
                                   key: value for key, value in data.items()}
                               })
 
-    return json.dumps(a, indent=4, sort_keys=True)
+    return a
 
 
 def get_description(service, options, flags):
@@ -218,15 +320,20 @@ def handle_not_given_options(service, offering=None, procedure=None,
     else:
         procedure = procedure
 
+    # the capabilities are parsed once by OWSLib, just look the offering up
+    # a single time instead of for every missing option
+    if observed_properties == '' or event_time == '':
+        offering_contents = service[offering]
+
     if observed_properties == '':
-        observed_properties = service[offering].observed_properties
+        observed_properties = offering_contents.observed_properties
     else:
         observed_properties = observed_properties.split(',')
 
     if event_time == '':
-        begin_timestamp = str(service[offering].begin_position)
+        begin_timestamp = str(offering_contents.begin_position)
         begin_timestamp = 'T'.join(begin_timestamp.split(' '))
-        end_timestamp = str(service[offering].end_position)
+        end_timestamp = str(offering_contents.end_position)
         end_timestamp = 'T'.join(end_timestamp.split(' '))
         event_time = '{}/{}'.format(begin_timestamp, end_timestamp)
     else:
@@ -272,31 +379,514 @@ def standardize_table_name(name_parts):
     :return table_name: table_name with unsupported characters replaced
         with '_'
     """
-    table_name = name_parts[0]
-    for i in name_parts[1:]:
-        table_name = '{}_{}'.format(table_name, i)
-
-    if ':' in table_name:
-        table_name = '_'.join(table_name.split(':'))
-    if '-' in table_name:
-        table_name = '_'.join(table_name.split('-'))
-    if '.' in table_name:
-        table_name = '_'.join(table_name.split('.'))
+    table_name = '_'.join(str(i) for i in name_parts)
 
-    return table_name
+    return table_name.translate(_table_name_translation)
 
 
 def get_transformation(crs, target):
     """Get the transformation key.
 
-    The key is to be used to transform your sensor coordinates
+    The key is to be used to transform your sensor coordinates. Keys are
+    cached, so PROJ is initialized only once for every couple of CRS
 
     :param crs: The original CRS of sensors
     :param target: The target CRS for sensors
     :return transform: The transformation key
     """
-    source = osr.SpatialReference()
-    source.ImportFromEPSG(crs)
-    transform = osr.CoordinateTransformation(source, target)
+    key = (crs, target.ExportToWkt())
+    if key not in _transformations:
+        source = osr.SpatialReference()
+        source.ImportFromEPSG(crs)
+        _transformations.update(
+            {key: osr.CoordinateTransformation(source, target)})
+
+    return _transformations[key]
+
+
+def transform_points(points, crs, target):
+    """Transform coordinates of sensors into the target CRS.
+
+    All the points are transformed by one call of PROJ instead of
+    transforming a geometry for every sensor
+
+    :param points: List of (x, y, z) coordinates in the original CRS
+    :param crs: The original CRS of sensors
+    :param target: The target CRS for sensors
+    :return transformed: List of (x, y, z) coordinates in the target CRS
+    """
+    if len(points) == 0:
+        return list()
+
+    transformed = get_transformation(crs, target).TransformPoints(points)
+
+    return transformed
+
+
+def get_session(username=None, password=None):
+    """Return a HTTP session to be shared by all requests of one module run.
+
+    The session keeps the connection to the SOS server alive, so the TCP (and
+    TLS) handshake is not repeated for every request
+
+    :param username: Username with access to server
+    :param password: Password according to username
+    :return session: requests.Session() object
+    """
+    session = requests.Session()
+    if username:
+        session.auth = (username, password)
+
+    # the pool is as large as the thread pools sharing the session, failed
+    # connections and overloaded servers are retried
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=16,
+                          max_retries=Retry(total=3, backoff_factor=0.3,
+                                            status_forcelist=(502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get_observation(service, session, offering, observed_properties,
+                    response_format, procedure=None, event_time=None,
+                    timeout=30):
+    """Request observations of one offering using a shared HTTP session.
+
+    The KVP GetObservation request is built directly (as OWSLib does for SOS
+    1.0.0), but sent through the given session instead of opening a new
+    connection. Other versions are requested through OWSLib
+
+    :param service: SensorObservationService() type object of request
+    :param session: requests.Session() object used for the request
+    :param offering: A collection of sensors used to conveniently group them up
+    :param observed_properties: List of the phenomena that are observed
+    :param response_format: Format of data output
+    :param procedure: Who provide the observations (mostly the sensor)
+    :param event_time: Timestamp of first/timestamp of last requested
+        observation
+    :param timeout: Timeout for SOS request
+    :return response: Raw response from SOS server
+    """
+    if service.version not in ['1.0.0', '1.0']:
+        # the credentials of the session are forwarded to OWSLib
+        username, password = session.auth or (None, None)
+        return service.get_observation(offerings=[offering],
+                                       responseFormat=response_format,
+                                       observedProperties=observed_properties,
+                                       procedure=procedure,
+                                       eventTime=event_time,
+                                       timeout=timeout,
+                                       username=username,
+                                       password=password)
+
+    url = service.url
+    for method in service.get_operation_by_name('GetObservation').methods:
+        if method['type'].lower() == 'get':
+            url = method['url']
+            break
+
+    params = {'service': 'SOS',
+              'version': service.version,
+              'request': 'GetObservation',
+              'offering': offering,
+              'observedProperty': ','.join(observed_properties),
+              'responseFormat': response_format}
+    if procedure:
+        params.update({'procedure': procedure})
+    if event_time:
+        params.update({'eventTime': event_time})
+
+    response = session.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    response = response.content
+
+    _check_exception_report(response, 'GetObservation of {}'.format(offering))
+
+    return response
+
+
+def _check_exception_report(response, request):
+    """Raise ValueError if the SOS server answered by an exception report.
+
+    :param response: Raw response from SOS server
+    :param request: Description of the request used in the error message
+    """
+    if response.lstrip().startswith(b'<'):
+        # only the root element is read to detect an exception report
+        _, root = next(etree.iterparse(io.BytesIO(response),
+                                       events=('start',)))
+        if root.tag.endswith('ExceptionReport'):
+            raise ValueError('SOS server returned an exception report for '
+                             '{}'.format(request))
+
+
+def get_cached_observation(service, session, offering, observed_properties,
+                           response_format, procedure=None, event_time=None,
+                           timeout=30, cache_file=None, cache_ttl=0):
+    """Request observations, reusing a response downloaded not long ago.
+
+    Raw responses are stored in a shelve database keyed on a hash of the
+    request parameters, so re-running a module with the same request does
+    not query the SOS server again until cache_ttl expires. Expired responses
+    are removed whenever a new one is stored
+
+    :param service: SensorObservationService() type object of request
+    :param session: requests.Session() object used for the request
+    :param offering: A collection of sensors used to conveniently group them up
+    :param observed_properties: List of the phenomena that are observed
+    :param response_format: Format of data output
+    :param procedure: Who provide the observations (mostly the sensor)
+    :param event_time: Timestamp of first/timestamp of last requested
+        observation
+    :param timeout: Timeout for SOS request
+    :param cache_file: Path to the shelve database, None disables the cache
+    :param cache_ttl: Seconds for which a cached response is valid
+    :return response: Raw response from SOS server
+    """
+    if not cache_file or cache_ttl <= 0:
+        return get_observation(service, session, offering,
+                               observed_properties, response_format,
+                               procedure=procedure, event_time=event_time,
+                               timeout=timeout)
+
+    # responses of authenticated requests are not shared between users
+    username = (session.auth or (None, None))[0]
+    key = hashlib.sha1(repr((
+        service.url, service.version, offering, list(observed_properties),
+        procedure, event_time, response_format,
+        username)).encode('utf-8')).hexdigest()
+
+    with _cache_lock:
+        cache = shelve.open(cache_file)
+        try:
+            cached = cache.get(key)
+        finally:
+            cache.close()
+
+    if cached is not None and time.time() - cached[0] < cache_ttl:
+        return cached[1]
+
+    response = get_observation(service, session, offering, observed_properties,
+                               response_format, procedure=procedure,
+                               event_time=event_time, timeout=timeout)
+
+    with _cache_lock:
+        cache = shelve.open(cache_file)
+        try:
+            # expired responses are dropped, the cache does not grow forever;
+            # their times are read from the index, not from the responses
+            now = time.time()
+            index = cache.get(_cache_index_key, dict())
+            for expired in [k for k, stored in index.items()
+                            if now - stored >= cache_ttl]:
+                del index[expired]
+                if expired in cache:
+                    del cache[expired]
+            index.update({key: now})
+            cache[key] = (now, response)
+            cache[_cache_index_key] = index
+        finally:
+            cache.close()
+
+    return response
+
+
+def get_observations(service, session, requests_params, response_format,
+                     timeout=30, max_workers=8, cache_file=None, cache_ttl=0):
+    """Request observations of several offerings concurrently.
+
+    Requests are sent from a pool of threads, so the server latencies of the
+    offerings overlap. The function returns without waiting, the responses
+    can be processed one by one while the others are still being downloaded
+
+    :param service: SensorObservationService() type object of request
+    :param session: requests.Session() object used for the requests
+    :param requests_params: Dictionary in format
+        {offering: (procedure, observed_properties, event_time)}
+    :param response_format: Format of data output
+    :param timeout: Timeout for SOS request
+    :param max_workers: Maximal number of concurrent requests
+    :param cache_file: Path to the shelve database of cached responses
+    :param cache_ttl: Seconds for which a cached response is valid, 0 means
+        the cache is not used
+    :return responses: Dictionary in format {offering: Future} where result()
+        of the Future returns the raw response or raises the request error
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(requests_params))))
+    responses = dict()
+
+    for offering, params in requests_params.items():
+        procedure, observed_properties, event_time = params
+        responses.update({offering: executor.submit(
+            get_cached_observation, service, session, offering,
+            observed_properties, response_format, procedure=procedure,
+            event_time=event_time, timeout=timeout, cache_file=cache_file,
+            cache_ttl=cache_ttl)})
+
+    executor.shutdown(wait=False)
+
+    return responses
+
+
+def describe_sensor(service, session, procedure, output_format, timeout=30):
+    """Request description of one sensor using a shared HTTP session.
+
+    The KVP DescribeSensor request is built directly (as OWSLib does for SOS
+    1.0.0), but sent through the given session instead of opening a new
+    connection. Other versions are requested through OWSLib
+
+    :param service: SensorObservationService() type object of request
+    :param session: requests.Session() object used for the request
+    :param procedure: The procedure (sensor) to be described
+    :param output_format: Format of the sensor description
+    :param timeout: Timeout for SOS request
+    :return response: Raw response from SOS server
+    """
+    if service.version not in ['1.0.0', '1.0']:
+        response = service.describe_sensor(procedure=procedure,
+                                           outputFormat=output_format)
+        _check_exception_report(response,
+                                'DescribeSensor of {}'.format(procedure))
+        return response
+
+    url = service.url
+    for method in service.get_operation_by_name('DescribeSensor').methods:
+        if method['type'].lower() == 'get':
+            url = method['url']
+            break
+
+    params = {'service': 'SOS',
+              'version': service.version,
+              'request': 'DescribeSensor',
+              'procedure': procedure,
+              'outputFormat': output_format}
+
+    response = session.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    response = response.content
+
+    # a description of an unknown procedure would fail later in parse_sensor
+    _check_exception_report(response, 'DescribeSensor of {}'.format(procedure))
+
+    return response
+
+
+def describe_sensors(service, session, procedures, output_format,
+                     timeout=30, max_workers=16):
+    """Request descriptions of several sensors concurrently.
+
+    DescribeSensor requests are sent from a pool of threads. Downloaded
+    descriptions are kept, so a procedure is described only once during a
+    module run even if it belongs to several offerings
+
+    :param service: SensorObservationService() type object of request
+    :param session: requests.Session() object used for the requests
+    :param procedures: List of procedures (sensors) to be described
+    :param output_format: Format of the sensor descriptions
+    :param timeout: Timeout for every SOS request
+    :param max_workers: Maximal number of concurrent requests
+    :return descriptions: Dictionary in format {procedure: raw response}
+    """
+    missing = [proc for proc in procedures
+               if (service.url, proc, output_format) not in _descriptions]
+
+    if len(missing) > 0:
+        with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(missing))) as executor:
+            responses = dict()
+            for proc in missing:
+                responses.update({proc: executor.submit(
+                    describe_sensor, service, session, proc,
+                    output_format, timeout)})
+
+            for proc, response in responses.items():
+                _descriptions.update(
+                    {(service.url, proc, output_format): response.result()})
+
+    descriptions = dict()
+    for proc in procedures:
+        descriptions.update(
+            {proc: _descriptions[(service.url, proc, output_format)]})
+
+    return descriptions
+
+
+def parse_sensor(description):
+    """Read the attributes of a sensor from its SensorML description.
+
+    Only the needed elements are looked up in the ElementTree, the document
+    is not converted into the whole OWSLib SensorML object graph
+
+    :param description: Raw SensorML response of DescribeSensor
+    :return sensor: Dictionary with name, description, keywords, sensor_type,
+        system_type, crs and coordinates (x, y, z) of the sensor
+    """
+    root = etree.fromstring(description)
+    # the first member of the document is the system of the sensor
+    system = root.find('sml:member/*', _sensorml_namespaces)
+
+    classifiers = dict()
+    for classifier in system.iterfind(
+            'sml:classification/sml:ClassifierList/sml:classifier',
+            _sensorml_namespaces):
+        classifiers.update({classifier.get('name'): _xml_text(
+            classifier.find('sml:Term/sml:value', _sensorml_namespaces))})
+
+    keywords = list()
+    for keyword in system.iterfind(
+            'sml:keywords/sml:KeywordList/sml:keyword', _sensorml_namespaces):
+        # empty keywords would break joining them
+        text = _xml_text(keyword)
+        if text:
+            keywords.append(text)
+
+    point = system.find('sml:location', _sensorml_namespaces)[0]
+    coords = point[0].text.replace('\n', '').split(',')
+
+    sensor = {'name': _xml_text(system.find('gml:name',
+                                            _sensorml_namespaces)),
+              'description': _xml_text(system.find('gml:description',
+                                                   _sensorml_namespaces)),
+              'keywords': keywords,
+              'sensor_type': classifiers.get('Sensor Type'),
+              'system_type': classifiers.get('System Type'),
+              'crs': int(point.attrib['srsName'].split(':')[-1]),
+              'coordinates': (float(coords[0]), float(coords[1]),
+                              float(coords[2]))}
+
+    return sensor
+
+
+def _xml_text(element):
+    """Get the stripped text of an element (None if there is no text).
+
+    :param element: ElementTree element or None
+    :return text: Text of the element
+    """
+    if element is None or element.text is None:
+        return None
+
+    return element.text.strip()
+
+
+def aggregate_observations(buckets, procedures_indices, values, procedures,
+                           epoch_s, seconds_granularity, method='average'):
+    """Aggregate observations by intervals and procedures.
+
+    All the observations are reduced at once with numpy.bincount instead of
+    summing a python list for every interval and procedure
+
+    :param buckets: Index of the interval of every observation
+    :param procedures_indices: Index of the procedure of every observation
+    :param values: Observed values
+    :param procedures: Names of procedures ordered by their indices
+    :param epoch_s: Seconds since epoch of the beginning of obs
+    :param seconds_granularity: Granularity in seconds
+    :param method: Aggregation method (average or sum)
+    :return intervals: Dictionary in format
+        {interval: [(procedure, aggregated value), ...]}
+    """
+    procedures_count = len(procedures)
+    keys = np.asarray(buckets, dtype=np.int64) * procedures_count + \
+        np.asarray(procedures_indices, dtype=np.int64)
+    # only the non-empty (interval, procedure) couples are kept
+    keys, inverse = np.unique(keys, return_inverse=True)
+    aggregated_values = np.bincount(
+        inverse, weights=np.asarray(values, dtype=np.float64))
+    if method == 'average':
+        aggregated_values = aggregated_values / np.bincount(inverse)
+    # TODO: Other aggregations methods
+
+    intervals = dict()
+    for key, value in zip(keys.tolist(), aggregated_values.tolist()):
+        bucket, procedure_index = divmod(key, procedures_count)
+        interval = epoch_s + bucket * seconds_granularity
+        intervals.setdefault(interval, list()).append(
+            (procedures[procedure_index], value))
+
+    return intervals
+
+
+def event_time_to_seconds(event_time):
+    """Get the beginning and the end of event_time in seconds since epoch.
+
+    Both timestamps are sliced directly, time.strptime() is not needed for
+    the fixed format YYYY-mm-ddTHH:MM:SS
+
+    :param event_time: Timestamp of first/timestamp of last requested
+        observation
+    :return epoch_s, epoch_e: Seconds since epoch of the beginning and the end
+    """
+    # TODO: Timezone
+    start_time = event_time.split('+')[0]
+    end_time = event_time.split('+')[1].split('/')[1]
+
+    bounds = list()
+    for timestamp in (start_time, end_time):
+        bounds.append(calendar.timegm((
+            int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+            int(timestamp[11:13]), int(timestamp[14:16]),
+            int(timestamp[17:19]), 0, 0, 0)))
+
+    return bounds[0], bounds[1]
+
+
+def timestamps_to_seconds(timestamps):
+    """Convert timestamps in format tYYYYmmddTHHMMSS to seconds since epoch.
+
+    Timestamps are treated as UTC, so the conversion is reversible by
+    seconds_to_timestamp() regardless of DST. Digits of all timestamps are
+    read at once from their bytes, no strptime is called
+
+    :param timestamps: List of timestamps of observations without timezone
+    :return seconds: numpy array of seconds since epoch
+    """
+    chars = np.array(timestamps, dtype='S')
+    if chars.size and chars.dtype.itemsize != 16:
+        raise ValueError('Timestamps must be in format tYYYYmmddTHHMMSS')
+    # shorter timestamps are padded with zero bytes, caught as non-digits
+    chars = chars.view(np.uint8).reshape(-1, 16)
+    digits = np.delete(chars, [0, 9], axis=1)
+    if (chars[:, 0] != ord('t')).any() or (chars[:, 9] != ord('T')).any() \
+            or ((digits < ord('0')) | (digits > ord('9'))).any():
+        raise ValueError('Timestamps must be in format tYYYYmmddTHHMMSS')
+
+    digits = chars.astype(np.int64) - ord('0')
+
+    def number(start, end):
+        return digits[:, start:end].dot(
+            10 ** np.arange(end - start - 1, -1, -1))
+
+    month = number(5, 7)
+    day = number(7, 9)
+    hour = number(10, 12)
+    minute = number(12, 14)
+    second = number(14, 16)
+    # out of range fields would silently roll over to the next unit
+    if ((month < 1) | (month > 12) | (day < 1) | (day > 31) | (hour > 23) |
+            (minute > 59) | (second > 60)).any():
+        raise ValueError('Timestamps must be in format tYYYYmmddTHHMMSS')
+
+    months = (number(1, 5) - 1970).astype('datetime64[Y]').astype(
+        'datetime64[M]') + (month - 1).astype('timedelta64[M]')
+    days = months.astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+    # days beyond the end of their month (e.g. February 30)
+    if (days.astype('datetime64[M]') != months).any():
+        raise ValueError('Timestamps must be in format tYYYYmmddTHHMMSS')
+
+    return days.astype(np.int64) * 86400 + hour * 3600 + minute * 60 + second
+
+
+def seconds_to_timestamp(seconds):
+    """Convert seconds since epoch to timestamp in format tYYYYmmddTHHMMSS.
+
+    :param seconds: Seconds since epoch
+    :return timestamp: Timestamp used in names of maps and columns
+    """
+    if seconds not in _timestamps:
+        _timestamps.update({seconds: time.strftime('t%Y%m%dT%H%M%S',
+                                                   time.gmtime(seconds))})
 
-    return transform
+    return _timestamps[seconds]
@@ -73,6 +73,14 @@
 #% guisection: Request
 #%end
 #%option
+#% key: timeout
+#% type: integer
+#% description: Timeout for SOS request
+#% required: no
+#% answer: 30
+#% guisection: Request
+#%end
+#%option
 #% key: response_format
 #% type: string
 #% options: text/xml;subtype="om/1.0.0", application/json
@@ -130,6 +138,15 @@
 #% answer: 1.0.0
 #%end
 #%option
+#% key: cache_ttl
+#% type: integer
+#% label: Time in seconds for which downloaded observations are reused
+#% description: Responses are cached in the current mapset, 0 disables cache
+#% answer: 0
+#% required: no
+#% guisection: Request
+#%end
+#%option
 #% key: bbox
 #% type: string
 #% label: Bounding box
@@ -163,15 +180,14 @@
 
 
 import sys
-import json
-import time
-import datetime
+import atexit
 import os
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 try:
     from owslib.sos import SensorObservationService
-    from owslib.swe.sensor.sml import SensorML
-    from osgeo import ogr
-    from grass.script import parser, run_command, overwrite
+    import numpy as np
+    from grass.script import parser, run_command, write_command, overwrite
     from grass.script import core as grass
     from grass.pygrass.vector import VectorTopo
     from grass.pygrass.vector.geometry import Point
@@ -189,19 +205,25 @@ if path is None:
 sys.path.append(path)
 
 
+# HTTP session shared by all the requests of the run, closed in cleanup()
+session = None
+
+
 def cleanup():
-    pass
+    if session is not None:
+        session.close()
 
 
 def main():
+    global session
+
     parsed_obs = dict()
     service = SensorObservationService(options['url'],
                                        version=options['version'],
                                        username=options['username'],
                                        password=options['password'])
 
-    if any(value is True and key in [
-      'o', 'v', 'p', 't'] for key, value in flags.items()):
+    if any(flags[key] for key in ('o', 'v', 'p', 't')):
         soslib.get_description(service, options, flags)
 
     soslib.check_missing_params(options['offering'], options['output'])
@@ -237,40 +259,42 @@ def main():
                       'every map.')
 
     target = soslib.get_target_crs()
+    session = soslib.get_session(options['username'], options['password'])
 
-    for off in options['offering'].split(','):
+    offerings = options['offering'].split(',')
+    requests_params = dict()
+    for off in offerings:
         # TODO: Find better way than iteration (at best OWSLib upgrade)
-        out = soslib.handle_not_given_options(
+        requests_params.update({off: soslib.handle_not_given_options(
             service, off, options['procedure'], options['observed_properties'],
-            options['event_time'])
-        procedure, observed_properties, event_time = out
+            options['event_time'])})
+
+    if not flags['s']:
+        gisenv = grass.gisenv()
+        cache_file = os.path.join(gisenv['GISDBASE'], gisenv['LOCATION_NAME'],
+                                  gisenv['MAPSET'], 'sos_cache')
+        responses = soslib.get_observations(
+            service, session, requests_params, options['response_format'],
+            timeout=int(options['timeout']), cache_file=cache_file,
+            cache_ttl=int(options['cache_ttl']))
+
+    for off in offerings:
+        procedure, observed_properties, event_time = requests_params[off]
 
         if flags['s']:
-            create_maps(_, off, _, resolution, _, service, target, procedure)
+            create_maps(_, off, _, resolution, _, service, target, procedure,
+                        session)
         else:
             try:
-                obs = service.get_observation(
-                    offerings=[off],
-                    responseFormat=options['response_format'],
-                    observedProperties=observed_properties,
-                    procedure=procedure,
-                    eventTime=event_time,
-                    username=options['username'],
-                    password=options['password'])
+                obs = responses[off].result()
             except:
                 # TODO: catch errors properly (e.g. timeout)
                 grass.fatal('Request did not succeed!')
 
             try:
-                if options['version'] in ['1.0.0', '1.0'] and \
-                  options['response_format'] == 'text/xml;subtype="om/1.0.0"':
-                    for prop in observed_properties:
-                        parsed_obs.update(
-                            {prop: soslib.xml2geojson(obs, prop)})
-                elif str(options['response_format']) == 'application/json':
-                    for prop in observed_properties:
-                        parsed_obs.update(
-                            {prop: soslib.json2geojson(obs, prop)})
+                parsed_obs.update(soslib.parse_observation(
+                    obs, observed_properties,
+                    str(options['response_format']), options['version']))
             except AttributeError:
                 if sys.version_info[0] >= 3:
                     sys.tracebacklimit = None
@@ -294,7 +318,7 @@ def main():
 
 
 def create_maps(parsed_obs, offering, seconds_granularity, resolution,
-                event_time, service, target, procedures=None):
+                event_time, service, target, procedures=None, session=None):
     """Create raster maps.
 
     Maps represent offerings, observed props and procedures
@@ -307,17 +331,18 @@ def create_maps(parsed_obs, offering, seconds_granularity, resolution,
     :param service: SensorObservationService() type object of request
     :param target:
     :param procedures: List of queried procedures (observation providors)
+    :param session: requests.Session() object shared by the requests
     """
     if flags['s']:
         maps_without_observations(offering, resolution, service, procedures,
-                                  target)
+                                  target, session)
     else:
         full_maps(parsed_obs, offering, seconds_granularity,
                   resolution, event_time, target)
 
 
 def maps_without_observations(offering, resolution, service, procedures,
-                              target):
+                              target, session):
     """Import just pixels/sensors without their observations.
 
     :param offering: A collection of sensors used to conveniently group them up
@@ -325,58 +350,53 @@ def maps_without_observations(offering, resolution, service, procedures,
     :param service: SensorObservationService() type object of request
     :param procedures: List of queried procedures (observation providors)
     :param target:
+    :param session: requests.Session() object shared by the requests
     """
-    offs = [o.id for o in service.offerings]
-    off_idx = offs.index(offering)
     output_format = service.get_operation_by_name('DescribeSensor').parameters[
         'outputFormat']['values'][0]
 
     if procedures:
         procedures = procedures.split(',')
     else:
-        procedures = service.offerings[off_idx].procedures
+        procedures = service[offering].procedures
 
     tempfile_path = grass.tempfile()
-    n = None
-    s = None
-    e = None
-    w = None
+
+    # all the sensors are described concurrently
+    descriptions = soslib.describe_sensors(service, session, procedures,
+                                           output_format,
+                                           timeout=int(options['timeout']))
+
+    # coordinates of sensors grouped by their crs, {crs: [(x, y, z)]}
+    source_coords = dict()
+    for proc in procedures:
+        sensor = soslib.parse_sensor(descriptions[proc])
+        source_coords.setdefault(sensor['crs'], list()).append(
+            sensor['coordinates'])
+
+    # sensors are transformed into the target crs by one call for every
+    # source crs
+    xyz = list()
+    for crs, coords in source_coords.items():
+        xyz.extend(soslib.transform_points(coords, crs, target))
+
+    if len(xyz) == 0:
+        # no region can be computed without sensors
+        grass.warning('No sensors found for offering {}, no map is '
+                      'created'.format(offering))
+        return
+
+    # the region covers the cells of all the sensors
+    xs = [coords[0] for coords in xyz]
+    ys = [coords[1] for coords in xyz]
+    n = max(ys) + resolution / 2
+    s = min(ys) - resolution / 2
+    e = max(xs) + resolution / 2
+    w = min(xs) - resolution / 2
 
     with open(tempfile_path, 'w') as tempFile:
-        for proc in procedures:
-            response = service.describe_sensor(procedure=proc,
-                                               output_format=output_format)
-            root = SensorML(response)
-            system = root.members[0]
-            crs = int(system.location[0].attrib['srsName'].split(':')[-1])
-            coords = system.location[0][0].text.replace('\n', '')
-            sx = float(coords.split(',')[0])
-            sy = float(coords.split(',')[1])
-            sz = float(coords.split(',')[2])
-            transform = soslib.get_transformation(crs, target)
-            point = ogr.CreateGeometryFromWkt('POINT ({} {} {})'.format(sx,
-                                                                        sy,
-                                                                        sz))
-            point.Transform(transform)
-            x = point.GetX()
-            y = point.GetY()
-            z = point.GetZ()
-            tempFile.write('{} {} {}\n'.format(x, y, z))
-
-            if not n:
-                n = y + resolution / 2
-                s = y - resolution / 2
-                e = x + resolution / 2
-                w = x - resolution / 2
-            else:
-                if y >= n:
-                    n = y + resolution / 2
-                if y <= s:
-                    s = y - resolution / 2
-                if x >= e:
-                    e = x + resolution / 2
-                if x <= w:
-                    w = x - resolution / 2
+        tempFile.write('\n'.join(
+            '{} {} {}'.format(*coords) for coords in xyz) + '\n')
 
     run_command('g.region', n=n, s=s, w=w, e=e, res=resolution)
     run_command('r.in.xyz',
@@ -398,73 +418,78 @@ def full_maps(parsed_obs, offering, seconds_granularity, resolution,
     :param event_time: Timestamp of first/of last requested observation
     :param target:
     """
-    timestamp_pattern = '%Y-%m-%dT%H:%M:%S'  # TODO: Timezone
-    start_time = event_time.split('+')[0]
-    epoch_s = int(time.mktime(time.strptime(start_time, timestamp_pattern)))
-    end_time = event_time.split('+')[1].split('/')[1]
-    epoch_e = int(time.mktime(time.strptime(end_time, timestamp_pattern)))
+    epoch_s, epoch_e = soslib.event_time_to_seconds(event_time)
+
+    # options used for every bucket are looked up just once
+    output = options['output']
+    keep_vectors = flags['k']
+    auto_bbox = options['bbox'] == ''
+    if options['method'] == 'average':
+        xyz_method = 'mean'
+    else:
+        xyz_method = 'sum'
 
-    for key, observation in parsed_obs.items():
+    # rasters are independent, they are created in parallel in the end
+    rasters = list()
+
+    for key, data in parsed_obs.items():
         print('Creating raster maps for offering '
               '{}, observed property {}'.format(offering, key))
 
-        data = json.loads(observation)
         crs = data['crs']
         crs = int(crs['properties']['name'].split(':')[-1])
-        transform = soslib.get_transformation(crs, target)
 
         cols = [(u'cat', 'INTEGER PRIMARY KEY'), (u'name', 'VARCHAR'),
                 (u'value', 'DOUBLE')]
 
-        geometries = dict()
-        intervals = {}
-        for secondsStamp in range(epoch_s, epoch_e + 1, seconds_granularity):
-            intervals.update({secondsStamp: dict()})
-
-        timestamp_pattern = 't%Y%m%dT%H%M%S'  # TODO: Timezone
+        geometries_names = list()
+        source_coords = list()
+        procedures = dict()
+        timestamps = list()
+        # typed arrays, numbers are stored unboxed and contiguously
+        procedures_indices = array('q')
+        values = array('d')
+        buckets_count = (epoch_e - epoch_s) // seconds_granularity + 1
 
         for a in data['features']:
             name = a['properties']['name']
 
-            sx, sy, sz = a['geometry']['coordinates']
-            point = ogr.CreateGeometryFromWkt('POINT ({} {} {})'.format(sx,
-                                                                        sy,
-                                                                        sz))
-            point.Transform(transform)
-            coords = (point.GetX(), point.GetY(), point.GetZ())
-            geometries.update({name: coords})
+            geometries_names.append(name)
+            source_coords.append(tuple(a['geometry']['coordinates']))
+            procedure_index = procedures.setdefault(name, len(procedures))
+            observations_count = len(timestamps)
 
             for timestamp, value in a['properties'].items():
                 if timestamp != 'name':
-                    observation_start_time = timestamp[:-4]
-                    seconds_timestamp = int(time.mktime(
-                        time.strptime(observation_start_time,
-                                      timestamp_pattern)))
-                    for interval in intervals.keys():
-                        if interval <= seconds_timestamp < (
-                                    interval + seconds_granularity):
-                            if name in intervals[interval].keys():
-                                intervals[interval][name].append(float(value))
-                            else:
-                                intervals[interval].update(
-                                    {name: [float(value)]})
-                            break
-
-        for interval in intervals.keys():
-            if len(intervals[interval]) != 0:
-                timestamp = datetime.datetime.fromtimestamp(
-                    interval).strftime('t%Y%m%dT%H%M%S')
-
-                table_name = '{}_{}_{}_{}'.format(options['output'],
-                                                  offering, key,
-                                                  timestamp)
-                if ':' in table_name:
-                    table_name = '_'.join(table_name.split(':'))
-                if '-' in table_name:
-                    table_name = '_'.join(table_name.split('-'))
-                if '.' in table_name:
-                    table_name = '_'.join(table_name.split('.'))
+                    timestamps.append(timestamp[:-4])
+                    values.append(float(value))
 
+            observations_count = len(timestamps) - observations_count
+            procedures_indices.extend(
+                array('q', [procedure_index]) * observations_count)
+
+        # all the sensors are transformed into the target crs at once
+        geometries = dict(zip(
+            geometries_names,
+            soslib.transform_points(source_coords, crs, target)))
+
+        # all timestamps of the observed property are parsed at once
+        buckets = (soslib.timestamps_to_seconds(timestamps) -
+                   epoch_s) // seconds_granularity
+        in_range = (buckets >= 0) & (buckets < buckets_count)
+
+        intervals = soslib.aggregate_observations(
+            buckets[in_range], np.asarray(procedures_indices)[in_range],
+            np.asarray(values)[in_range], list(procedures.keys()), epoch_s,
+            seconds_granularity, options['method'])
+
+        for interval, procedures_values in intervals.items():
+            timestamp = soslib.seconds_to_timestamp(interval)
+
+            table_name = soslib.standardize_table_name(
+                [output, offering, key, timestamp])
+
+            if keep_vectors is True:
                 new = VectorTopo(table_name)
                 if overwrite() is True:
                     try:
@@ -474,64 +499,94 @@ def full_maps(parsed_obs, offering, seconds_granularity, resolution,
 
                 new.open(mode='w', layer=1, tab_name=table_name,
                          link_name=table_name, tab_cols=cols, overwrite=True)
-                i = 0
-                n = None
-                s = None
-                e = None
-                w = None
-
-                for procedure, values in intervals[interval].items():
-                    if new.exist() is False:
-                        i = 1
+                rows = list()
+
+            # the raster is always created from these points by r.in.xyz
+            xyz = list()
+
+            n = None
+            s = None
+            e = None
+            w = None
+
+            for i, (procedure, value) in enumerate(procedures_values,
+                                                   start=1):
+                if keep_vectors is True:
+                    new.write(Point(*geometries[procedure]), cat=i)
+                    rows.append((i, procedure, value))
+
+                x, y, z = geometries[procedure]
+                xyz.append('{} {} {}'.format(x, y, value))
+
+                if auto_bbox:
+                    if not n:
+                        n = y + resolution / 2
+                        s = y - resolution / 2
+                        e = x + resolution / 2
+                        w = x - resolution / 2
                     else:
-                        i += 1
-
-                    if options['method'] == 'average':
-                        value = sum(values) / len(values)
-                    elif options['method'] == 'sum':
-                        value = sum(values)
-                    # TODO: Other aggregations methods
-
-                    new.write(Point(*geometries[procedure]),
-                              cat=i,
-                              attrs=(procedure, value,))
-
-                    if options['bbox'] == '':
-                        x, y, z = geometries[procedure]
-                        if not n:
+                        if y >= n:
                             n = y + resolution / 2
+                        if y <= s:
                             s = y - resolution / 2
+                        if x >= e:
                             e = x + resolution / 2
+                        if x <= w:
                             w = x - resolution / 2
-                        else:
-                            if y >= n:
-                                n = y + resolution / 2
-                            if y <= s:
-                                s = y - resolution / 2
-                            if x >= e:
-                                e = x + resolution / 2
-                            if x <= w:
-                                w = x - resolution / 2
 
+            if keep_vectors is True:
+                # all the attributes of the bucket in one transaction
+                new.table.insert(rows, many=True)
                 new.table.conn.commit()
 
-                new.close(build=False)
-                run_command('v.build', quiet=True, map=table_name)
+                # topology is built in this process, no v.build needed
+                new.close()
+
+            if auto_bbox:
+                region = dict(n=n, s=s, w=w, e=e, res=resolution)
+            else:
+                region = None
+
+            rasters.append((table_name, '\n'.join(xyz) + '\n', region))
+
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    futures = [executor.submit(rasterize, raster_name, xyz, xyz_method,
+                               region)
+               for raster_name, xyz, region in rasters]
+    executor.shutdown()
+    for future in futures:
+        # raise errors of the workers
+        future.result()
 
-                if options['bbox'] == '':
-                    run_command('g.region', n=n, s=s, w=w, e=e, res=resolution)
 
-                run_command('v.to.rast', input=table_name, output=table_name,
-                            use='attr', attribute_column='value', layer=1,
-                            type='point', quiet=True)
+def rasterize(raster_name, xyz, method, region=None):
+    """Create a raster map from points using r.in.xyz.
+
+    The region is passed to r.in.xyz in the GRASS_REGION environment
+    variable instead of being set by g.region, so several rasters with
+    different regions can be created at the same time
+
+    :param raster_name: Name of the output raster map
+    :param xyz: Points in format 'x y value' separated by newlines
+    :param method: Statistic used for points in the same cell
+    :param region: Dictionary of g.region parameters (n, s, e, w, res), None
+        to use the current region
+    """
+    if region:
+        env = os.environ.copy()
+        env['GRASS_REGION'] = grass.region_env(**region)
+    else:
+        env = None
 
-                if flags['k'] is False:
-                    run_command('g.remove', 'f', type='vector',
-                                name=table_name, quiet=True)
+    # points are streamed to r.in.xyz through stdin
+    write_command('r.in.xyz', input='-', output=raster_name,
+                  separator='space', method=method, type='DCELL',
+                  quiet=True, stdin=xyz, env=env)
 
 
 if __name__ == "__main__":
     options, flags = parser()
+    atexit.register(cleanup)
 
     try:
         import soslib
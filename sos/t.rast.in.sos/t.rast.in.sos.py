@@ -156,18 +156,10 @@
 
 
 import sys
-import json
-from sqlite3 import OperationalError
 try:
-    from owslib.sos import SensorObservationService
-    from grass.script import parser, run_command, overwrite
+    from grass.script import parser, run_command
     from grass.script import core as grass
-    from grass.script import vector
-    from grass.pygrass.vector import VectorTopo
-    from grass.pygrass.vector.geometry import Point
-    from grass.pygrass.vector.table import Link
     from grass.pygrass.utils import get_lib_path
-    import grass.temporal as tgis
 except ImportError as e:
     sys.stderr.write('Error importing internal libs. '
                      'Did you run the script from GRASS GIS?\n')
@@ -184,19 +176,22 @@ def cleanup():
 
 
 def main():
-    fl = str()
-    for f, val in flags.items():
-        if val is True:
-            fl += f
+    fl = ''.join(f for f, val in flags.items() if val is True)
 
     try:
         run_command('r.in.sos', flags=fl, **options)
     except:
         return 0
-    if any(value is True and key in [
-           'o', 'v', 'p', 't'] for key, value in flags.items()):
+    if any(flags[key] for key in ('o', 'v', 'p', 't')):
         return 0
 
+    # OWSLib is imported only when the maps are really going to be registered
+    try:
+        from owslib.sos import SensorObservationService
+    except ImportError as e:
+        sys.stderr.write('Error importing OWSLib.\n')
+        raise e
+
     service = SensorObservationService(options['url'],
                                        version=options['version'],
                                        username=options['username'],
@@ -209,14 +204,8 @@ def main():
         procedure, observed_properties, event_time = out
 
         for observed_property in observed_properties:
-            map_name = '{}_{}_{}'.format(options['output'], off,
-                                         observed_property)
-            if ':' in map_name:
-                map_name = '_'.join(map_name.split(':'))
-            if '-' in map_name:
-                map_name = '_'.join(map_name.split('-'))
-            if '.' in map_name:
-                map_name = '_'.join(map_name.split('.'))
+            map_name = soslib.standardize_table_name(
+                [options['output'], off, observed_property])
 
             maps_list_file = get_maps(map_name)
             create_temporal(maps_list_file, map_name)
@@ -254,17 +243,26 @@ def create_temporal(maps_list_file, map_name):
                                            '_'.join(map_name.split('_')[2:])),
                 description='Raster space time dataset')
 
-    with open(maps_list_file, 'r') as maps:
-        for raster_map in maps.readlines():
+    # all maps are registered by one t.register run, its file is written
+    # while the list of maps is read line by line
+    register_file = grass.tempfile()
+    maps_count = 0
+    with open(maps_list_file, 'r') as maps, \
+            open(register_file, 'w') as register_list:
+        for raster_map in maps:
             a = raster_map.split('t')[-1]
             map_timestamp = '{}-{}-{} {}:{}'.format(a[0:4], a[4:6], a[6:8],
                                                     a[9:11], a[11:13])
-            run_command('t.register',
-                        type='raster',
-                        input=map_name,
-                        maps='{}'.format(raster_map.strip()),
-                        start=map_timestamp,
-                        quiet=True)
+            register_list.write('{}|{}\n'.format(raster_map.strip(),
+                                                 map_timestamp))
+            maps_count += 1
+
+    if maps_count > 0:
+        run_command('t.register',
+                    type='raster',
+                    input=map_name,
+                    file=register_file,
+                    quiet=True)
 
 
 if __name__ == "__main__":
@@ -144,21 +144,16 @@
 
 
 import sys
-from sqlite3 import OperationalError
-import json
-import tempfile
-import time
-import datetime
+import atexit
 try:
     from owslib.sos import SensorObservationService
-    from grass.script import parser, run_command, overwrite, pipe_command
+    import numpy as np
+    from grass.script import parser, run_command, overwrite
     from grass.script import core as grass
-    from grass.script import vector
     from grass.pygrass.vector import VectorTopo
     from grass.pygrass.vector.geometry import Point
     from grass.pygrass.vector.table import Link
     from grass.pygrass.utils import get_lib_path
-    import grass.temporal as tgis
 except ImportError as e:
     sys.stderr.write('Error importing internal libs. '
                      'Did you run the script from GRASS GIS?\n')
@@ -170,11 +165,18 @@ if path is None:
 sys.path.append(path)
 
 
+# HTTP session shared by all the requests of the run, closed in cleanup()
+session = None
+
+
 def cleanup():
-    pass
+    if session is not None:
+        session.close()
 
 
 def main():
+    global session
+
     parsed_obs = dict()
 
     service = SensorObservationService(options['url'],
@@ -182,8 +184,7 @@ def main():
                                        username=options['username'],
                                        password=options['password'])
 
-    if any(value is True and key in [
-      'o', 'v', 'p', 't'] for key, value in flags.items()):
+    if any(flags[key] for key in ('o', 'v', 'p', 't')):
         soslib.get_description(service, options, flags)
 
     soslib.check_missing_params(options['offering'], options['output'])
@@ -197,34 +198,36 @@ def main():
     else:
         seconds_granularity = 1
 
-    for off in options['offering'].split(','):
+    session = soslib.get_session(options['username'], options['password'])
+
+    offerings = options['offering'].split(',')
+    requests_params = dict()
+    for off in offerings:
         # TODO: Find better way than iteration (at best OWSLib upgrade)
-        out = soslib.handle_not_given_options(
+        requests_params.update({off: soslib.handle_not_given_options(
             service, off, options['procedure'], options['observed_properties'],
-            options['event_time'])
-        procedure, observed_properties, event_time = out
+            options['event_time'])})
+
+    # all offerings are requested concurrently, responses are processed
+    # one by one as they are needed
+    responses = soslib.get_observations(service, session, requests_params,
+                                        options['response_format'])
+
+    # responses are parsed here (the XML ones in a single streaming pass)
+    # while the other offerings are still being downloaded
+    for off in offerings:
+        procedure, observed_properties, event_time = requests_params[off]
 
         try:
-            obs = service.get_observation(
-                offerings=[off],
-                responseFormat=options['response_format'],
-                observedProperties=observed_properties,
-                procedure=procedure,
-                eventTime=event_time,
-                username=options['username'],
-                password=options['password'])
+            obs = responses[off].result()
         except:
             # TODO: catch errors properly (e.g. timeout)
             grass.fatal('Request did not succeed!')
 
         try:
-            if options['version'] in ['1.0.0', '1.0'] and str(
-              options['response_format']) == 'text/xml;subtype="om/1.0.0"':
-                for prop in observed_properties:
-                    parsed_obs.update({prop: soslib.xml2geojson(obs, prop)})
-            elif str(options['response_format']) == 'application/json':
-                for prop in observed_properties:
-                    parsed_obs.update({prop: soslib.json2geojson(obs, prop)})
+            parsed_obs.update(soslib.parse_observation(
+                obs, observed_properties, str(options['response_format']),
+                options['version']))
         except AttributeError:
             if sys.version_info[0] >= 3:
                 sys.tracebacklimit = None
@@ -248,24 +251,20 @@ def create_maps(parsed_obs, offering, seconds_granularity, event_time):
     :param seconds_granularity: Granularity in seconds
     :param event_time:
     """
-    timestamp_pattern = '%Y-%m-%dT%H:%M:%S'  # TODO: Timezone
-    start_time = event_time.split('+')[0]
-    epoch_s = int(time.mktime(time.strptime(start_time, timestamp_pattern)))
-    end_time = event_time.split('+')[1].split('/')[1]
-    epoch_e = int(time.mktime(time.strptime(end_time, timestamp_pattern)))
+    epoch_s, epoch_e = soslib.event_time_to_seconds(event_time)
 
-    for key, observation in parsed_obs.items():
+    # options used for every property and layer are looked up just once
+    output = options['output']
+    method = options['method']
+    db = '$GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db'
+
+    for key, data in parsed_obs.items():
 
         run_command('g.message',
                     message='Creating vector maps for {}...'.format(key))
 
-        map_name = '{}_{}_{}'.format(options['output'], offering, key)
-        if ':' in map_name:
-            map_name = '_'.join(map_name.split(':'))
-        if '-' in map_name:
-            map_name = '_'.join(map_name.split('-'))
-        if '.' in map_name:
-            map_name = '_'.join(map_name.split('.'))
+        map_name = soslib.standardize_table_name(
+            [output, offering, key])
 
         run_command('t.create',
                     output=map_name,
@@ -283,63 +282,56 @@ def create_maps(parsed_obs, offering, seconds_granularity, event_time):
             except:
                 pass
 
-        data = json.loads(observation)
-
         cols = [(u'cat', 'INTEGER PRIMARY KEY'), (u'name', 'VARCHAR'),
                 (u'value', 'DOUBLE')]
 
-        intervals = {}
-        for secondsStamp in range(epoch_s, epoch_e + 1, seconds_granularity):
-            intervals.update({secondsStamp: dict()})
-
-        timestamp_pattern = 't%Y%m%dT%H%M%S'  # TODO: Timezone
+        procedures_indices = list()
+        timestamps = list()
+        values = list()
 
         for a in data['features']:
-            name = a['properties']['name']
-            if a['properties']['name'] not in points.keys():
+            properties = a['properties']
+            name = properties['name']
+            cat = points.get(name)
+            if cat is None:
                 if new.is_open() is False:
                     new.open('w')
-                points.update({a['properties']['name']: free_cat})
+                cat = free_cat
+                points.update({name: cat})
                 new.write(Point(*a['geometry']['coordinates']))
                 free_cat += 1
 
-            for timestamp, value in a['properties'].items():
+            # categories are given in the order of procedures
+            procedure_index = cat - 1
+            for timestamp, value in properties.items():
                 if timestamp != 'name':
-                    observationstart_time = timestamp[:-4]
-                    seconds_timestamp = int(time.mktime(
-                        time.strptime(observationstart_time,
-                                      timestamp_pattern)))
-                    for interval in intervals.keys():
-                        if interval <= seconds_timestamp < (
-                                    interval + seconds_granularity):
-                            if name in intervals[interval].keys():
-                                intervals[interval][name].append(float(value))
-                            else:
-                                intervals[interval].update(
-                                    {name: [float(value)]})
-                            break
-
-        if new.is_open():
-            new.close(build=False)
-            run_command('v.build', map=map_name, quiet=True)
-
+                    procedures_indices.append(procedure_index)
+                    timestamps.append(timestamp[:-4])
+                    values.append(float(value))
+
+        # all timestamps of the observed property are parsed at once and
+        # the intervals are computed, not searched for
+        seconds_timestamps = soslib.timestamps_to_seconds(timestamps)
+        buckets = (seconds_timestamps - epoch_s) // seconds_granularity
+        in_range = (seconds_timestamps >= epoch_s) & \
+            (epoch_s + buckets * seconds_granularity <= epoch_e)
+
+        # only the intervals containing any observation are created
+        intervals = soslib.aggregate_observations(
+            buckets[in_range], np.asarray(procedures_indices)[in_range],
+            np.asarray(values)[in_range], list(points.keys()), epoch_s,
+            seconds_granularity, method)
+
+        # the map stays open for the layers, it is closed (and its topology
+        # built) only once
         i = 1
         layers_timestamps = list()
-        for interval in intervals.keys():
+        for interval in sorted(intervals):
             if len(intervals[interval]) != 0:
-                timestamp = datetime.datetime.fromtimestamp(
-                    interval).strftime('t%Y%m%dT%H%M%S')
-                table_name = '{}_{}_{}_{}'.format(options['output'], offering,
-                                                  key, timestamp)
-                if ':' in table_name:
-                    table_name = '_'.join(table_name.split(':'))
-                if '-' in table_name:
-                    table_name = '_'.join(table_name.split('-'))
-                if '.' in table_name:
-                    table_name = '_'.join(table_name.split('.'))
-
-                new.open('rw')
-                db = '$GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db'
+                timestamp = soslib.seconds_to_timestamp(interval)
+                table_name = soslib.standardize_table_name(
+                    [output, offering, key, timestamp])
+
                 link = Link(layer=i, name=table_name, table=table_name,
                             key='cat', database=db, driver='sqlite')
                 new.dblinks.add(link)
@@ -349,19 +341,16 @@ def create_maps(parsed_obs, offering, seconds_granularity, event_time):
                 i += 1
                 layers_timestamps.append(timestamp)
 
-                for name, values in intervals[interval].items():
-                    if options['method'] == 'average':
-                        aggregated_value = sum(values) / len(values)
-                    elif options['method'] == 'sum':
-                        aggregated_value = sum(values)
+                rows = list()
+                for name, aggregated_value in intervals[interval]:
+                    rows.append((points[name], name, aggregated_value))
 
-                    new.table.insert(tuple([points[name],
-                                            name,
-                                            aggregated_value]))
-                    new.table.conn.commit()
+                # all the rows of the layer in one transaction
+                new.table.insert(rows, many=True)
+                new.table.conn.commit()
 
-                new.close(build=False)
-                run_command('v.build', map=map_name, quiet=True)
+        if new.is_open():
+            new.close()
 
         create_temporal(map_name, i, layers_timestamps)
 
@@ -379,22 +368,30 @@ def create_temporal(vector_map, layers_count, layers_timestamps):
     run_command('g.message',
                 message='Registering maps in the space time dataset...')
 
-    for i in range(1, layers_count):
-        layer_timestamp = '{}-{}-{} {}:{}'.format(
-            layers_timestamps[i - 1][1:5], layers_timestamps[i - 1][5:7],
-            layers_timestamps[i - 1][7:9], layers_timestamps[i - 1][10:12],
-            layers_timestamps[i - 1][12:14])
+    if layers_count < 2:
+        return
+
+    # all layers are registered by one t.register run
+    register_file = grass.tempfile()
+    with open(register_file, 'w') as register_list:
+        for i, timestamp in enumerate(layers_timestamps[:layers_count - 1],
+                                      start=1):
+            layer_timestamp = '{}-{}-{} {}:{}'.format(
+                timestamp[1:5], timestamp[5:7], timestamp[7:9],
+                timestamp[10:12], timestamp[12:14])
+            register_list.write('{}:{}|{}\n'.format(vector_map, i,
+                                                    layer_timestamp))
 
-        run_command('t.register',
-                    type='vector',
-                    input=vector_map,
-                    maps='{}:{}'.format(vector_map, i),
-                    start=layer_timestamp,
-                    quiet=True)
+    run_command('t.register',
+                type='vector',
+                input=vector_map,
+                file=register_file,
+                quiet=True)
 
 
 if __name__ == "__main__":
     options, flags = parser()
+    atexit.register(cleanup)
 
     try:
         import soslib
@@ -160,15 +160,12 @@
 
 
 import sys
+import atexit
 import os
-import json
-import time
-import datetime
 try:
     from owslib.sos import SensorObservationService
-    from owslib.swe.sensor.sml import SensorML
-    from osgeo import ogr
-    from grass.script import parser, run_command, read_command
+    import numpy as np
+    from grass.script import parser, run_command
     from grass.script import core as grass
     from grass.pygrass.vector import VectorTopo
     from grass.pygrass.vector.geometry import Point
@@ -185,12 +182,18 @@ if path is None:
 sys.path.append(path)
 
 
+# HTTP session shared by all the requests of the run, closed in cleanup()
+session = None
+
+
 def cleanup():
-    pass
+    if session is not None:
+        session.close()
 
 
 def main():
-    parsed_obs = dict()
+    global session
+
     layerscount = 0
 
     service = SensorObservationService(options['url'],
@@ -198,8 +201,7 @@ def main():
                                        username=options['username'],
                                        password=options['password'])
 
-    if any(value is True and key in [
-      'o', 'v', 'p', 't'] for key, value in flags.items()):
+    if any(flags[key] for key in ('o', 'v', 'p', 't')):
         soslib.get_description(service, options, flags)
 
     soslib.check_missing_params(options['offering'], options['output'])
@@ -218,40 +220,42 @@ def main():
     run_command('g.remove', 'f', type='vector', name=options['output'])
     new = VectorTopo(options['output'])
 
-    for off in options['offering'].split(','):
+    session = soslib.get_session(options['username'], options['password'])
+
+    offerings = options['offering'].split(',')
+    requests_params = dict()
+    for off in offerings:
         # TODO: Find better way than iteration (at best OWSLib upgrade)
-        out = soslib.handle_not_given_options(
+        requests_params.update({off: soslib.handle_not_given_options(
             service, off, options['procedure'], options['observed_properties'],
-            options['event_time'])
-        procedure, observed_properties, event_time = out
+            options['event_time'])})
+
+    if not flags['s']:
+        # all offerings are requested concurrently, responses are processed
+        # one by one as they are needed
+        responses = soslib.get_observations(
+            service, session, requests_params, options['response_format'],
+            timeout=int(options['timeout']))
+
+    for off in offerings:
+        procedure, observed_properties, event_time = requests_params[off]
 
         if flags['s']:
-            create_maps(_, off, _, new, _, _, service, target, _, procedure)
+            create_maps(None, off, None, new, None, None, service, target,
+                        None, procedure, session)
         else:
+            parsed_obs = dict()
             try:
-                obs = service.get_observation(
-                    offerings=[off],
-                    responseFormat=options['response_format'],
-                    observedProperties=observed_properties,
-                    procedure=procedure,
-                    eventTime=event_time,
-                    timeout=int(options['timeout']),
-                    username=options['username'],
-                    password=options['password'])
+                obs = responses[off].result()
             except:
                 # TODO: catch errors properly (e.g. timeout)
                 grass.fatal('Request did not succeed!')
 
             try:
-                if options['version'] in ['1.0.0', '1.0'] and str(
-                  options['response_format']) == 'text/xml;subtype="om/1.0.0"':
-                    for prop in observed_properties:
-                        parsed_obs.update(
-                            {prop: soslib.xml2geojson(obs, prop, flags['i'])})
-                elif str(options['response_format']) == 'application/json':
-                    for prop in observed_properties:
-                        parsed_obs.update(
-                            {prop: soslib.json2geojson(obs, prop)})
+                parsed_obs.update(soslib.parse_observation(
+                    obs, observed_properties,
+                    str(options['response_format']), options['version'],
+                    flags['i']))
             except AttributeError:
                 if sys.version_info[0] >= 3:
                     sys.tracebacklimit = None
@@ -268,15 +272,17 @@ def main():
                     sys.tracebacklimit = 0
                 raise e
 
-            create_maps(parsed_obs, off, layerscount, new,
-                        seconds_granularity, event_time, service, target,
-                        observed_properties)
-            layerscount += len(parsed_obs)
-        return 0
+            # layers of the next offering follow the ones really created
+            layerscount += create_maps(parsed_obs, off, layerscount, new,
+                                       seconds_granularity, event_time,
+                                       service, target, observed_properties)
+
+    return 0
 
 
 def create_maps(parsed_obs, offering, layer, new, seconds_granularity,
-                event_time, service, target, obs_props, procedures=None):
+                event_time, service, target, obs_props, procedures=None,
+                session=None):
     """Add layers to the vector map.
 
     Layers represent offerings and observed properties
@@ -291,28 +297,31 @@ def create_maps(parsed_obs, offering, layer, new, seconds_granularity,
     :param target: The target CRS for sensors
     :param obs_props: Oberved properties
     :param procedures: List of queried procedures (observation providers)
+    :param session: requests.Session() object shared by the requests
+    :return layers_count: Count of layers added to the vector map
     """
     if flags['s']:
-        maps_without_observations(offering, new, service, procedures, target)
+        maps_without_observations(offering, new, service, procedures, target,
+                                  session)
+        layers_count = 0
     else:
         i = layer + 1
-        timestamp_pattern = '%Y-%m-%dT%H:%M:%S'  # TODO: Timezone
-        start_time = event_time.split('+')[0]
-        epoch_s = int(time.mktime(time.strptime(start_time,
-                                                timestamp_pattern)))
-        end_time = event_time.split('+')[1].split('/')[1]
-        epoch_e = int(time.mktime(time.strptime(end_time, timestamp_pattern)))
+        epoch_s, epoch_e = soslib.event_time_to_seconds(event_time)
 
         if not flags['l']:
-            maps_rows_timestamps(parsed_obs, offering, new,
-                                 seconds_granularity, target, obs_props,
-                                 epoch_s, epoch_e, i)
+            layers_count = maps_rows_timestamps(
+                parsed_obs, offering, new, seconds_granularity, target,
+                obs_props, epoch_s, epoch_e, i)
         else:
-            maps_rows_sensors(parsed_obs, offering, new, seconds_granularity,
-                              target, epoch_s, epoch_e, layer+1)
+            layers_count = maps_rows_sensors(
+                parsed_obs, offering, new, seconds_granularity, target,
+                epoch_s, epoch_e, i)
+
+    return layers_count
 
 
-def maps_without_observations(offering, new, service, procedures, target):
+def maps_without_observations(offering, new, service, procedures, target,
+                              session):
     """Import just vector points/sensors without their observations.
 
     :param offering: A collection of sensors used to conveniently group them up
@@ -320,10 +329,8 @@ def maps_without_observations(offering, new, service, procedures, target):
     :param service: SensorObservationService() type object of request
     :param procedures: List of queried procedures (observation providors)
     :param target:
+    :param session: requests.Session() object shared by the requests
     """
-    points = dict()
-    free_cat = 1
-
     cols = [(u'cat', 'INTEGER PRIMARY KEY'),
             (u'name', 'varchar'),
             (u'description', 'varchar'),
@@ -336,7 +343,21 @@ def maps_without_observations(offering, new, service, procedures, target):
             (u'z', 'DOUBLE')]
     # new = Vector(new)
     if new.is_open() is False:
-        new.open('w', tab_name=options['output'], tab_cols=cols)
+        if new.exist():
+            # sensors of the previous offerings are kept
+            new.open('rw')
+            new.table = new.dblinks.by_layer(1).table()
+        else:
+            new.open('w', tab_name=options['output'], tab_cols=cols)
+
+    # sensors yet imported for the previous offerings are not duplicated and
+    # new ones continue from their categories
+    cursor = new.table.conn.cursor()
+    cursor.execute('SELECT cat, name FROM {}'.format(new.table.name))
+    points = dict()
+    for cat, name in cursor.fetchall():
+        points.update({name: cat})
+    free_cat = max(points.values()) + 1 if points else 1
     offs = [o.id for o in service.offerings]
     off_idx = offs.index(offering)
     output_format = service.get_operation_by_name('DescribeSensor').parameters[
@@ -347,43 +368,43 @@ def maps_without_observations(offering, new, service, procedures, target):
     else:
         procedures = service.offerings[off_idx].procedures
 
+    # all the sensors are described concurrently
+    descriptions = soslib.describe_sensors(service, session, procedures,
+                                           output_format,
+                                           timeout=int(options['timeout']))
+
+    rows = list()
     for proc in procedures:
-        response = service.describe_sensor(procedure=proc,
-                                           outputFormat=output_format)
-        root = SensorML(response)
-        system = root.members[0]
-        name = system.name
-        desc = system.description
-        keywords = ','.join(system.keywords)
-        sens_type = system.classifiers['Sensor Type'].value
-        sys_type = system.classifiers['System Type'].value
-        crs = int(system.location[0].attrib['srsName'].split(':')[-1])
-        coords = system.location[0][0].text.replace('\n', '')
-        sx = float(coords.split(',')[0])
-        sy = float(coords.split(',')[1])
-        sz = float(coords.split(',')[2])
-        # Set source projection from SOS
-        transform = soslib.get_transformation(crs, target)
-        point = ogr.CreateGeometryFromWkt(
-            'POINT ({} {} {})'.format(sx, sy, sz))
-        point.Transform(transform)
-        x = point.GetX()
-        y = point.GetY()
-        z = point.GetZ()
-        if name not in points.keys():
+        sensor = soslib.parse_sensor(descriptions[proc])
+        name = sensor['name']
+        sx, sy, sz = sensor['coordinates']
+        if name not in points:
             points.update({name: free_cat})
-            point = Point(x, y, z)
-            new.write(point, cat=free_cat, attrs=(
-                      u'{}'.format(system.name),
-                      system.description,
-                      ','.join(system.keywords),
-                      system.classifiers['Sensor Type'].value,
-                      system.classifiers['System Type'].value,
-                      crs,
-                      float(coords.split(',')[0]),
-                      float(coords.split(',')[1]),
-                      float(coords.split(',')[2]),))
+            rows.append((free_cat,
+                         u'{}'.format(name),
+                         sensor['description'],
+                         ','.join(sensor['keywords']),
+                         sensor['sensor_type'],
+                         sensor['system_type'],
+                         sensor['crs'],
+                         sx,
+                         sy,
+                         sz))
             free_cat += 1
+
+    # sensors are transformed into the target crs by one call for every
+    # source crs (rows contain the source crs and coordinates)
+    crs_rows = dict()
+    for row in rows:
+        crs_rows.setdefault(row[6], list()).append(row)
+    for crs, sensors in crs_rows.items():
+        coords = soslib.transform_points([row[7:] for row in sensors], crs,
+                                         target)
+        for row, (x, y, z) in zip(sensors, coords):
+            new.write(Point(x, y, z), cat=row[0])
+
+    # all the rows of the sensors in one transaction
+    new.table.insert(rows, many=True)
     new.table.conn.commit()
     new.close(build=True)
 
@@ -400,84 +421,69 @@ def maps_rows_sensors(parsed_obs, offering, new, seconds_granularity,
     :param new: Given vector map which should be updated with new layers
     :param seconds_granularity: Granularity in seconds
     :param target: The target CRS for sensors
-    :param epoch_s: time.mktime standardized timestamp of the beginning of obs
-    :param epoch_e: time.mktime standardized timestamp of the end of obs
+    :param epoch_s: UTC seconds timestamp of the beginning of obs
+    :param epoch_e: UTC seconds timestamp of the end of obs
     :param i: Index of the first free layer
+    :return layers_count: Count of layers added to the vector map
     """
     free_cat = 1
 
-    for key, observation in parsed_obs.items():
+    for key, data in parsed_obs.items():
         points = {}
 
         table_name = soslib.standardize_table_name(
             [options['output'], offering, key])
 
-        data = json.loads(observation)
-        # get the transformation between source and target crs
+        # the source crs of the sensors
         crs = data['crs']
         crs = int(crs['properties']['name'].split(':')[-1])
-        transform = soslib.get_transformation(crs, target)
-
-        intervals = {}
-        for seconds_stamp in range(epoch_s, epoch_e + 1, seconds_granularity):
-            intervals.update({seconds_stamp: dict()})
 
-        empty_procs = list()
-        timestamp_pattern = 't%Y%m%dT%H%M%S'  # TODO: Timezone
-        coords_dict = {}
+        source_coords = list()
+        first_cat = free_cat
+        procedures_indices = list()
+        timestamps = list()
+        values = list()
 
         cols = [(u'cat', 'INTEGER PRIMARY KEY'), (u'name', 'VARCHAR')]
 
-        if new.is_open() is True:
-            # close without printing that crazy amount of messages
-            new.close(build=False)
-            run_command('v.build', quiet=True, map=options['output'])
-            new.open('rw')
-        else:
-            new.open('w')
+        # the map stays open for all the properties, its topology is built
+        # only once at the end
+        if new.is_open() is False:
+            # layers of the previous offerings are kept
+            new.open('rw' if new.exist() else 'w')
 
         for a in data['features']:
             name = a['properties']['name']
-            empty = True
 
-            if name not in points.keys():
+            if name not in points:
                 points.update({name: free_cat})
-
-                # transform the geometry into the target crs
-                sx, sy, sz = a['geometry']['coordinates']
-                point = ogr.CreateGeometryFromWkt('POINT ({} {} {})'.format(
-                    sx, sy, sz))
-                point.Transform(transform)
-                coords = (point.GetX(), point.GetY(), point.GetZ())
-
-                coords_dict.update({free_cat: coords})
+                source_coords.append(tuple(a['geometry']['coordinates']))
                 free_cat += 1
 
+            procedure_index = points[name] - first_cat
             for timestamp, value in a['properties'].items():
                 if timestamp != 'name':
-                    if empty:
-                        empty = False
-                    observationstart_time = timestamp[:-4]
-                    seconds_timestamp = int(time.mktime(
-                        time.strptime(observationstart_time,
-                                      timestamp_pattern)))
-                    for interval in intervals.keys():
-                        if interval <= seconds_timestamp < (
-                                interval + seconds_granularity):
-                            if name in intervals[interval].keys():
-                                intervals[interval][name].append(float(value))
-                            else:
-                                timestamp2 = datetime.datetime.fromtimestamp(
-                                    interval).strftime('t%Y%m%dT%H%M%S')
-                                intervals[interval].update(
-                                    {name: [float(value)]})
-                                if (u'%s' % timestamp2, 'DOUBLE') not in cols:
-                                    cols.append((u'%s' % timestamp2, 'DOUBLE'))
-                            break
-
-            if empty:
-                # in value, there is name of the last proc
-                empty_procs.append(value)
+                    procedures_indices.append(procedure_index)
+                    timestamps.append(timestamp[:-4])
+                    values.append(float(value))
+
+        # all timestamps of the observed property are parsed at once, the
+        # intervals are computed and aggregated with numpy
+        seconds_timestamps = soslib.timestamps_to_seconds(timestamps)
+        buckets = (seconds_timestamps - epoch_s) // seconds_granularity
+        in_range = (seconds_timestamps >= epoch_s) & \
+            (epoch_s + buckets * seconds_granularity <= epoch_e)
+        intervals = soslib.aggregate_observations(
+            buckets[in_range], np.asarray(procedures_indices)[in_range],
+            np.asarray(values)[in_range], list(points.keys()), epoch_s,
+            seconds_granularity, options['method'])
+
+        # position of every timestamp column, not to search for it in cols
+        col_index = dict()
+        for interval in sorted(intervals):
+            timestamp = soslib.seconds_to_timestamp(interval)
+            col_index.update({timestamp: len(cols)})
+            cols.append((u'{}'.format(timestamp), 'DOUBLE'))
 
         if len(cols) > 2000:
             grass.warning(
@@ -491,55 +497,34 @@ def maps_rows_sensors(parsed_obs, offering, new, seconds_granularity,
             database='$GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db',
             driver='sqlite')
 
-        if new.is_open():
-            new.close()
-
-        new.open('rw')
         new.dblinks.add(link)
         new.table = new.dblinks[i - 1].table()
         new.table.create(cols)
-        inserts = dict()
 
-        new.close(build=False)
-        run_command('v.build', quiet=True, map=options['output'])
-        new.open('rw', layer=i)
+        # switch to the new layer without reopening the map
+        new.layer = i
 
-        for cat, coords in coords_dict.items():
+        # all the sensors are transformed into the target crs at once
+        for cat, coords in enumerate(
+                soslib.transform_points(source_coords, crs, target),
+                start=first_cat):
             new.write(Point(*coords), cat=cat)
 
-        # create attr tab inserts for empty procs
-        for emptyProc in empty_procs:
-            insert = [None] * len(cols)
-            insert[0] = points[emptyProc]
-            insert[1] = emptyProc
-            inserts.update({emptyProc: insert})
-
-        # create attr tab inserts for procs with observations
-        for interval in intervals.keys():
-            if len(intervals[interval]) != 0:
-                timestamp = datetime.datetime.fromtimestamp(
-                    interval).strftime('t%Y%m%dT%H%M%S')
-
-                for name, values in intervals[interval].items():
-                    if options['method'] == 'average':
-                        aggregated_value = sum(values) / len(values)
-                    elif options['method'] == 'sum':
-                        aggregated_value = sum(values)
-
-                    if name not in inserts.keys():
-                        insert = [None] * len(cols)
-                        insert[0] = points[name]
-                        insert[1] = name
-                        insert[cols.index((timestamp,
-                                           'DOUBLE'))] = aggregated_value
-                        inserts.update({name: insert})
-                    else:
-                        inserts[name][cols.index(
-                            (timestamp, 'DOUBLE'))] = aggregated_value
-
-        for insert in inserts.values():
-            new.table.insert(tuple(insert))
-            new.table.conn.commit()
+        # the table is allocated at once, one row for every procedure
+        # (categories follow the order of procedures), and the aggregated
+        # values are placed straight into their cells
+        rows = list()
+        for name, cat in points.items():
+            rows.append([cat, name] + [None] * (len(cols) - 2))
+
+        for interval in sorted(intervals):
+            column = col_index[soslib.seconds_to_timestamp(interval)]
+            for name, aggregated_value in intervals[interval]:
+                rows[points[name] - first_cat][column] = aggregated_value
+
+        # all the rows of the layer in one transaction
+        new.table.insert([tuple(row) for row in rows], many=True)
+        new.table.conn.commit()
 
         i += 1
 
@@ -547,6 +532,9 @@ def maps_rows_sensors(parsed_obs, offering, new, seconds_granularity,
     new.close(build=False)
     run_command('v.build', quiet=True, map=options['output'])
 
+    # one layer for every observed property
+    return len(parsed_obs)
+
 
 def maps_rows_timestamps(parsed_obs, offering, new, seconds_granularity,
                          target, obs_props, epoch_s, epoch_e, i):
@@ -560,172 +548,154 @@ def maps_rows_timestamps(parsed_obs, offering, new, seconds_granularity,
     :param seconds_granularity: Granularity in seconds
     :param target: The target CRS for sensors
     :param obs_props: Oberved properties
-    :param epoch_s: time.mktime standardized timestamp of the beginning of obs
-    :param epoch_e: time.mktime standardized timestamp of the end of obs
+    :param epoch_s: UTC seconds timestamp of the beginning of obs
+    :param epoch_e: UTC seconds timestamp of the end of obs
     :param i: Index of the first free layer
+    :return layers_count: Count of layers added to the vector map
     """
     db = '$GISDBASE/$LOCATION_NAME/$MAPSET/sqlite/sqlite.db'
 
     points = dict()
     free_cat = 1
-
-    for propIndex in range(len(obs_props)):
-        obs_props[propIndex] = soslib.standardize_table_name(
-            [obs_props[propIndex]])
-
-    for key, observation in parsed_obs.items():
+    # layers are shared by the properties, one for every procedure
+    free_layer = i
+
+    # the columns and the prefix of table names are the same for all the
+    # properties and procedures (obs_props given by the caller are kept)
+    cols = [(u'connection', 'INTEGER'), (u'timestamp', 'VARCHAR')]
+    for obsProp in obs_props:
+        cols.append((u'{}'.format(soslib.standardize_table_name([obsProp])),
+                     'DOUBLE'))
+    table_prefix = soslib.standardize_table_name([options['output'],
+                                                  offering])
+    # position of every column, not to search for it in cols
+    col_index = dict()
+    for index, col in enumerate(cols):
+        col_index.update({col[0]: index})
+
+    for key, data in parsed_obs.items():
         print('Working on the observed property {}'.format(key))
         key = soslib.standardize_table_name([key])
 
-        data = json.loads(observation)
-        # get the transformation between source and target crs
+        # the source crs of the sensors
         crs = data['crs']
         crs = int(crs['properties']['name'].split(':')[-1])
-        transform = soslib.get_transformation(crs, target)
-
-        empty_procs = list()
-        timestamp_pattern = 't%Y%m%dT%H%M%S'  # TODO: Timezone
-        cur_layer = i
-
-        cols = [(u'connection', 'INTEGER'), (u'timestamp', 'VARCHAR')]
-        for obsProp in obs_props:
-            cols.append((u'{}'.format(obsProp), 'DOUBLE'))
-
-        if new.is_open() is True:
-            # close without printing that crazy amount of messages
-            new.close(build=False)
-            run_command('v.build', quiet=True, map=options['output'])
-            new.open('rw')
-        else:
-            new.open('w')
 
+        # the map stays open for all the properties and procedures, it is
+        # closed (and its topology built) only once at the end
+        if new.is_open() is False:
+            # layers of the previous offerings are kept
+            new.open('rw' if new.exist() else 'w')
+
+        procedures = dict()
+        procedures_indices = list()
+        timestamps = list()
+        values = list()
+        new_procedures = list()
+        source_coords = list()
         for a in data['features']:
             name = a['properties']['name']
-
-            table_name = soslib.standardize_table_name(
-                [options['output'], offering, name])
-
-            intervals = {}
-            for seconds_stamp in range(epoch_s, epoch_e + 1,
-                                       seconds_granularity):
-                intervals.update({seconds_stamp: dict()})
-
-            empty = True
-
+            if name not in points and name not in procedures:
+                new_procedures.append(name)
+                source_coords.append(tuple(a['geometry']['coordinates']))
+            procedure_index = procedures.setdefault(name, len(procedures))
             for timestamp, value in a['properties'].items():
                 if timestamp != 'name':
-                    if empty:
-                        empty = False
-                    observationstart_time = timestamp[:-4]
-                    seconds_timestamp = int(time.mktime(
-                        time.strptime(observationstart_time,
-                                      timestamp_pattern)))
-                    for interval in intervals.keys():
-                        if interval <= seconds_timestamp < (
-                                interval + seconds_granularity):
-                            if name in intervals[interval].keys():
-                                intervals[interval][name].append(float(value))
-                            else:
-                                intervals[interval].update(
-                                    {name: [float(value)]})
-                            break
-
-            if empty:
-                # in value, there is name of the last proc
-                empty_procs.append(value)
-
-            if new.is_open() is True:
-                # close without printing that crazy amount of messages
-                new.close(build=False)
-                run_command('v.build', quiet=True, map=options['output'])
-            new.open('rw')
+                    procedures_indices.append(procedure_index)
+                    timestamps.append(timestamp[:-4])
+                    values.append(float(value))
+
+        # all timestamps of the observed property are parsed at once, the
+        # intervals are computed and aggregated with numpy
+        seconds_timestamps = soslib.timestamps_to_seconds(timestamps)
+        buckets = (seconds_timestamps - epoch_s) // seconds_granularity
+        in_range = (seconds_timestamps >= epoch_s) & \
+            (epoch_s + buckets * seconds_granularity <= epoch_e)
+        intervals = soslib.aggregate_observations(
+            buckets[in_range], np.asarray(procedures_indices)[in_range],
+            np.asarray(values)[in_range], list(procedures.keys()), epoch_s,
+            seconds_granularity, options['method'])
+
+        # sensors not written yet are transformed into the target crs at once
+        coords_dict = dict(zip(
+            new_procedures,
+            soslib.transform_points(source_coords, crs, target)))
+
+        # aggregated values of every procedure, {name: [(interval, value)]}
+        procedures_intervals = dict()
+        for interval in sorted(intervals):
+            for name, aggregated_value in intervals[interval]:
+                procedures_intervals.setdefault(name, list()).append(
+                    (interval, aggregated_value))
+
+        # the features were walked once above, layers are created for the
+        # procedures in the same order
+        for name in procedures:
+            table_name = soslib.standardize_table_name([table_prefix, name])
 
             yet_existing = False
-            if not new.dblinks.by_name(table_name):
+            link = new.dblinks.by_name(table_name)
+            if not link:
                 link = Link(
-                    layer=cur_layer, name=table_name, table=table_name,
+                    layer=free_layer, name=table_name, table=table_name,
                     key='connection',
                     database=db,
                     driver='sqlite')
                 new.dblinks.add(link)
-                new.table = new.dblinks[cur_layer - 1].table()
+                new.table = link.table()
                 new.table.create(cols)
+                free_layer += 1
             else:
                 yet_existing = True
+                new.table = link.table()
 
-            # open the right layer
-            new.close(build=False)
-            run_command('v.build', quiet=True, map=options['output'])
-            new.open('rw', layer=cur_layer)
+            # switch to the right layer without reopening the map
+            new.layer = link.layer
 
-            if name not in points.keys():
+            if name not in points:
                 points.update({name: free_cat})
-
-                # transform the geometry into the target crs
-                sx, sy, sz = a['geometry']['coordinates']
-                point = ogr.CreateGeometryFromWkt('POINT ({} {} {})'.format(
-                    sx, sy, sz))
-                point.Transform(transform)
-                coords = (point.GetX(), point.GetY(), point.GetZ())
-
-                new.write(Point(*coords), cat=free_cat)
+                new.write(Point(*coords_dict[name]), cat=free_cat)
                 free_cat += 1
 
-            inserts = dict()
+            # timestamps already present in the table of the procedure are
+            # read in one query of the opened connection
+            cursor = new.table.conn.cursor()
+            existing_timestamps = set()
+            if yet_existing:
+                cursor.execute('SELECT timestamp FROM {}'.format(table_name))
+                existing_timestamps.update(row[0] for row in cursor.fetchall())
+            update_sql = 'UPDATE {} SET {}=? WHERE timestamp=?'.format(
+                table_name, key)
+
+            # create attr tab inserts for procs with observations
+            rows = list()
+            for interval, aggregated_value in procedures_intervals.get(
+                    name, list()):
+                timestamp = soslib.seconds_to_timestamp(interval)
+                if timestamp in existing_timestamps:
+                    cursor.execute(update_sql, (aggregated_value, timestamp))
+                    continue
 
-            # create attr tab inserts for empty procs
-            for emptyProc in empty_procs:
                 insert = [None] * len(cols)
-                insert[0] = points[emptyProc]
-                insert[1] = emptyProc
-                inserts.update({emptyProc: insert})
+                insert[0] = points[name]
+                insert[1] = timestamp
+                insert[col_index[key]] = aggregated_value
 
-            # create attr tab inserts for procs with observations
-            for interval in intervals.keys():
-                if len(intervals[interval]) != 0:
-                    timestamp = datetime.datetime.fromtimestamp(
-                        interval).strftime('t%Y%m%dT%H%M%S')
-                    for name, values in intervals[interval].items():
-                        if options['method'] == 'average':
-                            aggregated_value = sum(values) / len(values)
-                        elif options['method'] == 'sum':
-                            aggregated_value = sum(values)
-
-                        if yet_existing:
-                            a = read_command(
-                                'db.select',
-                                sql='SELECT COUNT(*) FROM {} WHERE '
-                                    'timestamp="{}"'.format(table_name,
-                                                            timestamp)
-                            )
-                            if a.split('\n')[1] != '0':
-                                run_command(
-                                    'db.execute',
-                                    sql='UPDATE {} SET {}={} WHERE '
-                                        'timestamp="{}";'.format(
-                                            table_name, key, aggregated_value,
-                                            timestamp))
-                                continue
-
-                        # if name not in inserts.keys():
-                        insert = [None] * len(cols)
-                        insert[0] = points[name]
-                        insert[1] = timestamp
-                        insert[cols.index(
-                            (key, 'DOUBLE'))] = aggregated_value
-
-                        new.table.insert(tuple(insert))
-
-                new.table.conn.commit()
-
-            cur_layer += 1
+                rows.append(tuple(insert))
+
+            # all the new rows of the layer in one transaction
+            new.table.insert(rows, many=True)
+            new.table.conn.commit()
 
     new.close()
 
+    return free_layer - i
+
 
 if __name__ == "__main__":
 
     options, flags = parser()
+    atexit.register(cleanup)
 
     try:
         import soslib
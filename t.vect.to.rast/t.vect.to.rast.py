@@ -50,6 +50,9 @@ from grass.script import run_command, pipe_command
 import grass.temporal as tgis
 import grass.pygrass.modules as pymod
 
+# separators of the get_start_time() datetimes used in the names of maps
+_map_name_translation = str.maketrans(':- ', '___')
+
 
 def main(options, flags):
 
@@ -93,10 +96,8 @@ def get_maps(stvds):
 
     for oneMap in listOutput.splitlines():
         if first is False:
-            if oneMap.split('|')[0] in maps.keys():
-                maps[oneMap.split('|')[0]].append(oneMap.split('|')[1])
-            else:
-                maps.update({oneMap.split('|')[0]: [oneMap.split('|')[1]]})
+            vector_map, layer = oneMap.split('|')[0:2]
+            maps.setdefault(vector_map, list()).append(layer)
         else:
             first = False
 
@@ -121,14 +122,10 @@ def rasterize(options, vectorMaps, stampedMaps, dbif, overwrite):
             for mtimMap in stampedMaps:
                 if mtimMap.get_id().split('@')[0] == ':'.join([map, layer]):
                     extent = mtimMap.get_temporal_extent()
-                    mapName = '{}_{}'.format(options['basename'],
-                                             extent.get_start_time())
-                    if ':' in mapName:
-                        mapName = '_'.join(mapName.split(':'))
-                    if '-' in mapName:
-                        mapName = '_'.join(mapName.split('-'))
-                    if ' ' in mapName:
-                        mapName = '_'.join(mapName.split(' '))
+                    mapName = '{}_{}'.format(
+                        options['basename'],
+                        extent.get_start_time()).translate(
+                            _map_name_translation)
 
             newMap = tgis.open_new_map_dataset(mapName,
                                                None,